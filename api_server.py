@@ -0,0 +1,217 @@
+# api_server.py
+"""
+独立的异步 HTTP API，和 Streamlit UI 并行运行，包装 qa_engine 与 build_vector_all：
+
+    POST /ask          {"query": ..., "k": 4, "library": null, "history": [...]}
+    POST /ask/stream   同上，返回 NDJSON：{"type": "delta", "text": ...} ... {"type": "citations", ...}
+    GET  /search       ?q=...&k=4&library=...
+    GET  /documents    ?library=...
+    POST /ingest       multipart：file（PDF）+ source_url + library
+    GET  /health
+
+并发控制：同时最多 API_MAX_CONCURRENCY 个请求在执行，最多 API_MAX_QUEUE 个在排队，
+再多直接返回 503 + Retry-After（背压）；排队超过 API_QUEUE_TIMEOUT 秒同样返回 503。
+embedding / FAISS 检索 / Gemini 调用都在线程池里跑，不阻塞事件循环。
+
+启动：
+    python api_server.py --port 8000 --workers 2
+每个 worker 进程各自懒加载引擎；索引被重建后各进程会在下次查询时自动重新加载。
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Literal, Optional
+
+from fastapi import FastAPI, File, Form, HTTPException, Query, UploadFile
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field
+from starlette.background import BackgroundTask
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(ROOT, "new_ui"))
+
+import qa_engine as qe
+import worker
+from index_registry import document_counts, library_paths, list_libraries
+
+MAX_K = 20
+MAX_HISTORY = 50  # 更早的轮次反正会被 trim_history 按 token 预算丢掉
+MAX_CONCURRENCY = int(os.getenv("API_MAX_CONCURRENCY", "4"))
+MAX_QUEUE = int(os.getenv("API_MAX_QUEUE", "16"))
+QUEUE_TIMEOUT = float(os.getenv("API_QUEUE_TIMEOUT", "30"))
+
+app = FastAPI(title="Chemistry Student Info Chatbot API")
+_executor = ThreadPoolExecutor(max_workers=MAX_CONCURRENCY, thread_name_prefix="qa")
+
+
+class _Gate:
+    """并发上限 + 有界等待队列；队列满或等待超时返回 503"""
+
+    def __init__(self, limit: int, max_queue: int, timeout: float):
+        self._sem = asyncio.Semaphore(limit)
+        self._max_queue = max_queue
+        self._timeout = timeout
+        self.waiting = 0
+        self.active = 0
+
+    async def __aenter__(self):
+        if self._sem.locked() and self.waiting >= self._max_queue:
+            raise HTTPException(503, "server busy, retry later", headers={"Retry-After": "2"})
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._sem.acquire(), self._timeout)
+        except asyncio.TimeoutError:
+            raise HTTPException(503, "timed out waiting for a slot", headers={"Retry-After": "5"})
+        finally:
+            self.waiting -= 1
+        self.active += 1
+        return self
+
+    async def __aexit__(self, *exc):
+        self.active -= 1
+        self._sem.release()
+
+
+_gate: Optional[_Gate] = None
+_build_thread: Optional[threading.Thread] = None
+_ingesting = False  # 正在保存上传文件、构建线程还没启动
+
+
+def _run(fn, *args):
+    return asyncio.get_running_loop().run_in_executor(_executor, fn, *args)
+
+
+def _check_library(library: Optional[str]) -> Optional[str]:
+    if library and library not in list_libraries():
+        raise HTTPException(404, f"unknown library: {library}")
+    return library
+
+
+class Turn(BaseModel):
+    """history 里的一条消息，格式同 UI 的 messages，见 conversation.py"""
+    role: Literal["user", "assistant"]
+    content: str
+    context_ids: List[str] = Field(default_factory=list, max_length=MAX_K)
+
+
+class AskRequest(BaseModel):
+    query: str
+    k: int = Field(4, ge=1, le=MAX_K)
+    library: Optional[str] = None
+    history: Optional[List[Turn]] = Field(None, max_length=MAX_HISTORY)  # 此前的对话
+
+    def history_dicts(self) -> Optional[List[dict]]:
+        return [t.model_dump() for t in self.history] if self.history else None
+
+
+@app.on_event("startup")
+async def _startup():
+    global _gate
+    _gate = _Gate(MAX_CONCURRENCY, MAX_QUEUE, QUEUE_TIMEOUT)
+    # 后台预热默认资料库，进程启动后立即可以响应 /health
+    asyncio.get_running_loop().run_in_executor(_executor, qe.load_engine)
+
+
+@app.get("/health")
+async def health():
+    return {
+        "engine_loaded": qe.is_loaded(),
+        "libraries_loaded": qe.registry.loaded(),
+        "active": _gate.active,
+        "waiting": _gate.waiting,
+    }
+
+
+@app.post("/ask")
+async def ask(req: AskRequest):
+    _check_library(req.library)
+    async with _gate:
+        return await _run(qe.ask_question, req.query, req.k, req.library, req.history_dicts())
+
+
+@app.post("/ask/stream")
+async def ask_stream(req: AskRequest):
+    _check_library(req.library)
+    # 在开始响应之前拿到名额，这样队列满时客户端拿到的是 503 而不是半截流
+    await _gate.__aenter__()
+    released = False
+
+    async def release():
+        # body 结束时释放；客户端在 body 开始前就断开时 body 不会运行，由 background 兜底
+        nonlocal released
+        if not released:
+            released = True
+            await _gate.__aexit__(None, None, None)
+
+    async def body():
+        done = object()
+        try:
+            it = qe.ask_question_stream(req.query, req.k, req.library, req.history_dicts())
+            while True:
+                event = await _run(next, it, done)
+                if event is done:
+                    break
+                yield json.dumps(event, ensure_ascii=False) + "\n"
+        except Exception as e:
+            yield json.dumps({"type": "error", "error": str(e)}, ensure_ascii=False) + "\n"
+        finally:
+            await release()
+
+    return StreamingResponse(body(), media_type="application/x-ndjson", background=BackgroundTask(release))
+
+
+@app.get("/search")
+async def search(q: str, k: int = Query(4, ge=1, le=MAX_K), library: Optional[str] = None):
+    _check_library(library)
+    async with _gate:
+        return {"results": await _run(qe.search, q, k, library)}
+
+
+@app.get("/documents")
+async def documents(library: Optional[str] = None):
+    """只读目录和 doc_counts.json，不加载索引"""
+    _check_library(library)
+    pdf_dir = library_paths(library)["pdf_dir"]
+    counts = document_counts(library)
+    files = sorted(f for f in os.listdir(pdf_dir) if f.lower().endswith(".pdf")) if os.path.isdir(pdf_dir) else []
+    return {
+        "library": library or "default",
+        "documents": [{"name": f, "chunks": counts.get(f, 0)} for f in files],
+    }
+
+
+@app.post("/ingest", status_code=202)
+async def ingest(file: UploadFile = File(...), source_url: str = Form(...), library: Optional[str] = Form(None)):
+    """保存 PDF 并在后台增量建索引；同一进程同时只允许一个构建任务"""
+    global _build_thread, _ingesting
+    _check_library(library)
+    name = os.path.basename(file.filename or "")
+    if not name.lower().endswith(".pdf"):
+        raise HTTPException(400, "only .pdf files are accepted")
+    if not source_url.strip().lower().startswith(("http://", "https://")):
+        raise HTTPException(400, "source_url must be an http(s) URL")
+    # 检查和占位之间不能有 await，否则两个并发上传都能通过检查
+    if _ingesting or (_build_thread is not None and _build_thread.is_alive()):
+        raise HTTPException(409, "a build is already running", headers={"Retry-After": "10"})
+    _ingesting = True
+    try:
+        path = await _run(worker.save_pdf, file.file, name, source_url.strip(), library)
+        _build_thread = worker.build_index_async(target_pdf_path=path, library=library)
+    finally:
+        _ingesting = False
+    return {"saved": name, "status": "build started"}
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=1, help="worker processes")
+    args = parser.parse_args()
+    uvicorn.run("api_server:app", host=args.host, port=args.port, workers=args.workers, app_dir=ROOT)
@@ -0,0 +1,121 @@
+# bench_postprocess.py
+"""
+后处理基准：对比旧实现（逐 token re.sub / 不动点循环 / 来源×片段嵌套循环）
+和 postprocess.py 的单遍实现，答案长度和片段数逐级放大，看每单位耗时是否保持平稳。
+
+用法：
+    python bench_postprocess.py
+    python bench_postprocess.py --repeat 20
+"""
+import argparse
+import random
+import re
+import time
+from types import SimpleNamespace
+
+from postprocess import CitationStream, bold_keywords, build_source_index, format_citations, to_list
+
+WORDS = ("thesis submission deadline supervisor progression report enrolment ethics "
+         "training programme department student carers council tax scholarship").split()
+
+
+# ----------------- 旧实现（与 qa_engine 之前的代码相同） -----------------
+def _legacy_bold(text, query):
+    tokens = sorted({t.lower() for t in re.findall(r"[A-Za-z]{3,}", query)}, key=len, reverse=True)
+    for t in tokens:
+        text = re.sub(rf"(?i)\b({re.escape(t)})\b", r"**\1**", text)
+    return text
+
+
+def _legacy_citations(text, ordered_sources):
+    prev = None
+    while prev != text:
+        prev = text
+        text = re.sub(r"\[(\d+)\s*[,; ]\s*(\d+)\]", r"[\1][\2]", text)
+    max_n = len(ordered_sources)
+
+    def repl(m):
+        n = int(m.group(1))
+        if 1 <= n <= max_n:
+            return f"[[{n}]]({ordered_sources[n-1]})"
+        return m.group(0)
+    return re.sub(r"\[(\d+)\]", repl, text)
+
+
+def _legacy_source_map(docs):
+    source_to_id, ordered_sources = {}, []
+    for d in docs:
+        for s in to_list(d.metadata.get("source")):
+            if s not in source_to_id:
+                source_to_id[s] = len(source_to_id) + 1
+                ordered_sources.append(s)
+    chosen_list = []
+    for url in ordered_sources:
+        chosen = None
+        for d in docs:
+            if url in to_list(d.metadata.get("source")):
+                chosen = d
+                break
+        chosen_list.append(chosen)
+    return ordered_sources, chosen_list
+
+
+# ----------------- 数据 -----------------
+def _answer(n_words, n_sources, rng):
+    out = []
+    for i in range(n_words):
+        out.append(rng.choice(WORDS))
+        if i % 12 == 11:
+            a, b = rng.randint(1, n_sources), rng.randint(1, n_sources)
+            out.append(f"[{a}, {b}]." if i % 24 == 23 else f"[{a}].")
+    return " ".join(out)
+
+
+def _docs(n_docs):
+    return [
+        SimpleNamespace(page_content="x", metadata={"source": f"https://example.org/{i}"})
+        for i in range(n_docs)
+    ]
+
+
+def _time(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def run(repeat: int = 5):
+    rng = random.Random(0)
+    query = " ".join(WORDS)
+    print(f"{'words':>7} {'snippets':>9} | {'legacy us/word':>15} {'new us/word':>12} "
+          f"{'stream cite us/word':>20} | {'legacy map us':>14} {'new map us':>11}")
+    for n_words, n_docs in ((200, 4), (1000, 16), (5000, 64), (20000, 256)):
+        text = _answer(n_words, n_docs, rng)
+        docs = _docs(n_docs)
+        sources = [d.metadata["source"] for d in docs]
+
+        legacy = _time(lambda: _legacy_citations(_legacy_bold(text, query), sources), repeat)
+        new = _time(lambda: format_citations(bold_keywords(text, query), sources), repeat)
+
+        def streamed():
+            cs = CitationStream(sources)
+            for i in range(0, len(text), 40):
+                cs.feed(text[i:i + 40])
+            cs.flush()
+        stream = _time(streamed, repeat)
+
+        legacy_map = _time(lambda: _legacy_source_map(docs), repeat)
+        new_map = _time(lambda: build_source_index(docs), repeat)
+
+        print(f"{n_words:>7} {n_docs:>9} | {legacy / n_words * 1e6:>15.2f} {new / n_words * 1e6:>12.2f} "
+              f"{stream / n_words * 1e6:>20.2f} | {legacy_map * 1e6:>14.1f} {new_map * 1e6:>11.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    run(args.repeat)
@@ -1,19 +1,28 @@
 # build_vector_all.py
 import argparse
+import contextlib
 import glob
 import json
 import os
+import hashlib
 import re
-from typing import List
+import time
+from typing import Dict, List, Optional, Tuple
 
 import pytesseract
 from pdf2image import convert_from_path
 from pypdf import PdfReader
 
-from langchain_community.embeddings import HuggingFaceEmbeddings
 from langchain_community.vectorstores import FAISS
 from langchain.schema import Document
 
+from embedders import BACKENDS, make_embeddings
+from index_registry import DEFAULT_LIBRARY, VERSION_FILE, library_paths, mark_published
+
+try:
+    import fcntl
+except ImportError:  # Windows：没有 flock，只能依赖单个构建进程
+    fcntl = None
 from module_links import MODULE_LINKS
 
 from urllib.parse import quote
@@ -25,15 +34,18 @@ def _is_http_url(u: str) -> bool:
 # 可执行 tesseract 路径（你的环境已设此路径，如不同请自行调整）
 pytesseract.pytesseract.tesseract_cmd = "/opt/homebrew/bin/tesseract"
 
-# 目录常量
+# 目录常量（与 qa_engine 一样由 index_registry 决定，均为绝对路径，与当前工作目录无关）
 ROOT = os.path.dirname(os.path.abspath(__file__))
-INDEX_DIR = "vector_dbs_all"
-PDF_DIR = "pdfs"
+_DEFAULT_PATHS = library_paths(DEFAULT_LIBRARY)
+INDEX_DIR = _DEFAULT_PATHS["index_dir"]
+PDF_DIR = _DEFAULT_PATHS["pdf_dir"]
+LIBRARY = DEFAULT_LIBRARY
+EMBED_BACKEND = os.getenv("EMBED_BACKEND", "torch")
 STATIC_PDF_DIR = os.path.join(ROOT, ".streamlit", "static", "pdfs")
 os.makedirs(STATIC_PDF_DIR, exist_ok=True)
 
 # 手动链接映射（老师上传时可写入 links.json）
-LINKS_JSON = os.path.join(ROOT, "links.json")
+LINKS_JSON = _DEFAULT_PATHS["links_json"]
 try:
     with open(LINKS_JSON, "r", encoding="utf-8") as f:
         LINK_MAP = json.load(f) or {}
@@ -41,9 +53,93 @@ except Exception:
     LINK_MAP = {}
 
 
+# 每个 doc_id 的向量数，供管理界面直接读取（无需加载 FAISS / embedding 模型）
+DOC_COUNTS_JSON = "doc_counts.json"
+# 已索引文件清单：{fname: {path, size, mtime, hash, source}}，用于增量同步
+MANIFEST_JSON = "manifest.json"
+
+# links.json 按 (mtime, size) 缓存，避免每个 PDF 都重新打开解析
+_links_cache: Dict = {"key": None, "data": {}}
+
+
+def _links_map() -> Dict[str, str]:
+    try:
+        st = os.stat(LINKS_JSON)
+        key = (LINKS_JSON, st.st_mtime_ns, st.st_size)
+    except OSError:
+        return {}
+    if _links_cache["key"] != key:
+        try:
+            with open(LINKS_JSON, "r", encoding="utf-8") as f:
+                data = json.load(f) or {}
+        except Exception:
+            data = {}
+        _links_cache["key"], _links_cache["data"] = key, data
+    return _links_cache["data"]
+
+
+def _use_library(name: str):
+    """把索引 / PDF / links.json 路径切换到指定资料库（见 index_registry.py）"""
+    global LIBRARY, INDEX_DIR, PDF_DIR, LINKS_JSON
+    paths = library_paths(name)
+    LIBRARY = name
+    INDEX_DIR = paths["index_dir"]
+    PDF_DIR = paths["pdf_dir"]
+    LINKS_JSON = paths["links_json"]
+    os.makedirs(PDF_DIR, exist_ok=True)
+
+
 # ----------------- 基础：加载/创建索引 -----------------
+def _doc_counts(db) -> dict:
+    counts = {}
+    for v in db.docstore._dict.values():
+        did = v.metadata.get("doc_id")
+        if not did or did == "__init__":
+            continue
+        counts[did] = counts.get(did, 0) + 1
+    return counts
+
+
+@contextlib.contextmanager
+def _index_lock():
+    """
+    跨进程互斥：<index_dir>/.lock 上的 flock。
+    UI、API 的多个 worker 进程和 --watch 可能同时构建；
+    load -> 修改 -> save 必须整体串行，否则后保存的会覆盖先保存的文档和清单。
+    """
+    os.makedirs(INDEX_DIR, exist_ok=True)
+    with open(os.path.join(INDEX_DIR, ".lock"), "a") as fh:
+        if fcntl is not None:
+            fcntl.flock(fh, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(fh, fcntl.LOCK_UN)
+
+
+def _save_db(db):
+    """
+    先完整写到 .staging/，再用 os.replace 逐个换入，最后写版本标记（见 index_registry.mark_published）。
+    换入途中标记和文件对不上，查询进程会继续用旧索引，不会加载一半新一半旧的文件。
+    """
+    staging = os.path.join(INDEX_DIR, ".staging")
+    os.makedirs(staging, exist_ok=True)
+    db.save_local(staging)
+    with open(os.path.join(staging, DOC_COUNTS_JSON), "w", encoding="utf-8") as f:
+        json.dump(_doc_counts(db), f, ensure_ascii=False, indent=2)
+    if os.path.exists(os.path.join(INDEX_DIR, "index.pkl")) and not os.path.exists(
+        os.path.join(INDEX_DIR, VERSION_FILE)
+    ):
+        # 旧版本留下的索引没有标记：先给现有文件补上，换入途中才能被识别出来
+        mark_published(INDEX_DIR)
+    for name in ("index.faiss", "index.pkl", DOC_COUNTS_JSON):
+        os.replace(os.path.join(staging, name), os.path.join(INDEX_DIR, name))
+    mark_published(INDEX_DIR)
+
+
 def _load_db():
-    emb = HuggingFaceEmbeddings(model_name="all-MiniLM-L6-v2")
+    emb = make_embeddings(EMBED_BACKEND)
     index_path = os.path.join(INDEX_DIR, "index.faiss")
 
     if os.path.exists(index_path):
@@ -53,7 +149,7 @@ def _load_db():
     os.makedirs(INDEX_DIR, exist_ok=True)
     db = FAISS.from_texts(["__init__"], embedding=emb, metadatas=[{"doc_id": "__init__"}])
     db.delete(list(db.docstore._dict.keys()))
-    db.save_local(INDEX_DIR)
+    _save_db(db)
     return db, emb
 
 
@@ -84,14 +180,8 @@ def _source_for(fname: str, module_link: str) -> str:
     - If not provided (or not http/https), return empty string ("")
     - No fallback to MODULE_LINKS or /static
     """
-    manual = ""
-    try:
-        with open(LINKS_JSON, "r", encoding="utf-8") as f:
-            data = json.load(f) or {}
-        manual = (data.get(fname) or "").strip()
-    except Exception:
-        manual = ""
-
+    manual = _links_map().get(fname) or ""
+    manual = manual.strip() if isinstance(manual, str) else ""
     return manual if _is_http_url(manual) else ""
 
 
@@ -148,56 +238,252 @@ def _extract_chunks_from_pdf(pdf_path: str) -> List[Document]:
     return chunks
 
 
+# ----------------- 清单（manifest） -----------------
+def _manifest_path() -> str:
+    return os.path.join(INDEX_DIR, MANIFEST_JSON)
+
+
+def _load_manifest() -> Optional[Dict[str, Dict]]:
+    """没有清单时返回 None（区别于空清单）"""
+    try:
+        with open(_manifest_path(), "r", encoding="utf-8") as f:
+            return json.load(f) or {}
+    except Exception:
+        return None
+
+
+def _save_manifest(manifest: Dict[str, Dict]):
+    os.makedirs(INDEX_DIR, exist_ok=True)
+    tmp = _manifest_path() + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, _manifest_path())
+
+
+def _file_hash(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _manifest_entry(path: str, prev: Optional[Dict] = None) -> Dict:
+    """size/mtime 没变就沿用旧 hash，只有变了才重新计算"""
+    st = os.stat(path)
+    if prev and prev.get("size") == st.st_size and prev.get("mtime") == st.st_mtime:
+        digest = prev.get("hash")
+    else:
+        digest = _file_hash(path)
+    fname = os.path.basename(path)
+    return {
+        "path": path,
+        "size": st.st_size,
+        "mtime": st.st_mtime,
+        "hash": digest,
+        "source": _source_for(fname, MODULE_LINKS.get(os.path.splitext(fname)[0], "N/A")),
+    }
+
+
+def _keys_for(db, doc_id: str) -> List[str]:
+    return [k for k, v in db.docstore._dict.items() if v.metadata.get("doc_id") == doc_id]
+
+
 # ----------------- 操作：增量添加 / 删除 / 全量重建 -----------------
-def add_pdf_to_index(pdf_path: str):
-    db, _ = _load_db()
+def _add_pdf(db, pdf_path: str, manifest: Dict[str, Dict]) -> int:
+    """抽取并加入索引；同名文件已在索引里时先删掉旧 chunk，避免重复向量"""
     docs = _extract_chunks_from_pdf(pdf_path)
     if not docs:
         print(f"[warn] no docs extracted from {pdf_path}")
-        return
+        return 0
+    _delete_doc(db, os.path.basename(pdf_path), manifest)
     db.add_documents(docs)
-    db.save_local(INDEX_DIR)
-    print(f"[ok] added: {os.path.basename(pdf_path)} ({len(docs)} chunks)")
+    manifest[os.path.basename(pdf_path)] = _manifest_entry(pdf_path)
+    return len(docs)
+
+
+def _delete_doc(db, doc_id: str, manifest: Dict[str, Dict]) -> int:
+    manifest.pop(doc_id, None)
+    keys = _keys_for(db, doc_id)
+    if keys:
+        db.delete(keys)
+    return len(keys)
+
+
+def add_pdf_to_index(pdf_path: str):
+    with _index_lock():
+        db, _ = _load_db()
+        manifest = _load_manifest() or {}
+        n = _add_pdf(db, pdf_path, manifest)
+        if not n:
+            return
+        _save_db(db)
+        _save_manifest(manifest)
+    print(f"[ok] added: {os.path.basename(pdf_path)} ({n} chunks)")
 
 
 def delete_by_doc_id(doc_id: str):
-    db, _ = _load_db()
-    keys = [k for k, v in db.docstore._dict.items() if v.metadata.get("doc_id") == doc_id]
-    if not keys:
-        print(f"[warn] not found: {doc_id}")
-        return
-    db.delete(keys)
-    db.save_local(INDEX_DIR)
-    print(f"[ok] deleted: {doc_id} ({len(keys)} vectors)")
+    with _index_lock():
+        db, _ = _load_db()
+        manifest = _load_manifest() or {}
+        n = _delete_doc(db, doc_id, manifest)
+        _save_manifest(manifest)
+        if not n:
+            print(f"[warn] not found: {doc_id}")
+            return
+        _save_db(db)
+    print(f"[ok] deleted: {doc_id} ({n} vectors)")
 
 
 def rebuild_all():
-    db, _ = _load_db()
-    all_keys = list(db.docstore._dict.keys())
-    if all_keys:
-        db.delete(all_keys)
-        db.save_local(INDEX_DIR)
-
-    pdfs = sorted(glob.glob(os.path.join(PDF_DIR, "*.pdf")))
-    if not pdfs:
-        print("[warn] no pdf files in 'pdfs/'")
-    for p in pdfs:
-        add_pdf_to_index(p)
+    with _index_lock():
+        db, _ = _load_db()
+        all_keys = list(db.docstore._dict.keys())
+        if all_keys:
+            db.delete(all_keys)
+        manifest: Dict[str, Dict] = {}
+
+        pdfs = sorted(glob.glob(os.path.join(PDF_DIR, "*.pdf")))
+        if not pdfs:
+            print(f"[warn] no pdf files in '{PDF_DIR}'")
+        # 整个重建只加载一次模型和索引；全部完成后才一次性发布，
+        # 重建期间线上查询始终看到旧索引，不会看到空的或只建了一半的库
+        for p in pdfs:
+            n = _add_pdf(db, p, manifest)
+            if n:
+                print(f"[ok] added: {os.path.basename(p)} ({n} chunks)")
+        _save_db(db)
+        _save_manifest(manifest)
     print("[ok] rebuild done. total pdfs:", len(pdfs))
 
 
+# ----------------- 增量同步：只处理差异 -----------------
+def sync_index() -> Dict[str, List[str]]:
+    """整个同步在索引锁内进行，见 _index_lock"""
+    with _index_lock():
+        return _sync_index()
+
+
+def _sync_index() -> Dict[str, List[str]]:
+    """
+    对比 pdfs/ + links.json 与清单，只应用差异：
+    - 新文件：抽取 + embedding
+    - 已删除：删掉对应向量
+    - 内容变化（hash 不同）：删掉旧向量后重新 embedding
+    - 只有来源 URL 变化：就地更新 chunk 的 metadata，不重新 embedding
+    没有清单时（旧索引），已在索引里的文件视为已索引，只补齐清单和 metadata。
+    """
+    db, _ = _load_db()
+    manifest = _load_manifest()
+    if manifest is None:
+        indexed = set(_doc_counts(db))
+        manifest = {}
+        for p in glob.glob(os.path.join(PDF_DIR, "*.pdf")):
+            fname = os.path.basename(p)
+            if fname in indexed:
+                # source 置空，让下面的 metadata 检查统一刷新一次
+                manifest[fname] = dict(_manifest_entry(p), source=None)
+
+    on_disk = {os.path.basename(p): p for p in glob.glob(os.path.join(PDF_DIR, "*.pdf"))}
+    changes: Dict[str, List[str]] = {"added": [], "removed": [], "modified": [], "relinked": []}
+
+    for fname in sorted(set(manifest) - set(on_disk)):
+        _delete_doc(db, fname, manifest)
+        changes["removed"].append(fname)
+
+    for fname, path in sorted(on_disk.items()):
+        prev = manifest.get(fname)
+        if prev is None:
+            if _add_pdf(db, path, manifest):
+                changes["added"].append(fname)
+            continue
+
+        entry = _manifest_entry(path, prev)
+        if entry["hash"] != prev.get("hash"):
+            # _add_pdf 在提取成功后才替换旧片段；提取失败时保留旧片段和清单记录
+            if _add_pdf(db, path, manifest):
+                changes["modified"].append(fname)
+            continue
+
+        if entry["source"] != prev.get("source"):
+            for k in _keys_for(db, fname):
+                db.docstore._dict[k].metadata["source"] = entry["source"]
+            changes["relinked"].append(fname)
+        manifest[fname] = entry
+
+    if any(changes.values()):
+        _save_db(db)
+    _save_manifest(manifest)
+    print("[ok] sync: " + ", ".join(f"{k}={len(v)}" for k, v in changes.items()))
+    return changes
+
+
+def _fingerprint() -> Tuple:
+    """廉价的目录指纹：只 stat，不读文件内容"""
+    items = []
+    for p in sorted(glob.glob(os.path.join(PDF_DIR, "*.pdf")) + [LINKS_JSON]):
+        try:
+            st = os.stat(p)
+            items.append((p, st.st_size, st.st_mtime_ns))
+        except OSError:
+            pass
+    return tuple(items)
+
+
+def watch(interval: float = 2.0, settle: float = 1.0):
+    """
+    轮询 pdfs/ 和 links.json，发现变化且文件稳定（settle 秒内不再变化，
+    避免拷贝到一半就开始处理）后调用 sync_index()。Ctrl+C 退出。
+    """
+    print(f"[ok] watching {PDF_DIR}/ and {os.path.basename(LINKS_JSON)} (every {interval}s)")
+    sync_index()
+    last = _fingerprint()
+    try:
+        while True:
+            time.sleep(interval)
+            cur = _fingerprint()
+            if cur == last:
+                continue
+            while True:
+                time.sleep(settle)
+                settled = _fingerprint()
+                if settled == cur:
+                    break
+                cur = settled
+            try:
+                sync_index()
+            except Exception as e:
+                print(f"[warn] sync failed: {e}")
+            last = _fingerprint()
+    except KeyboardInterrupt:
+        print("[ok] watcher stopped")
+
+
 # ----------------- CLI -----------------
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--pdf", type=str, help="only index this PDF (incremental)")
     parser.add_argument("--delete", type=str, help="delete by doc_id (filename)")
     parser.add_argument("--rebuild", action="store_true", help="rebuild all")
+    parser.add_argument("--sync", action="store_true", help="apply only changes in pdfs/ and links.json")
+    parser.add_argument("--watch", action="store_true", help="keep watching pdfs/ and links.json, syncing on change")
+    parser.add_argument("--interval", type=float, default=2.0, help="poll interval for --watch (seconds)")
+    parser.add_argument("--embed-backend", choices=BACKENDS, default=EMBED_BACKEND,
+                        help="embedding backend (see embedders.py)")
+    parser.add_argument("--library", type=str, default=None,
+                        help="library name (default: vector_dbs_all/ + pdfs/ + links.json)")
     args = parser.parse_args()
+    EMBED_BACKEND = args.embed_backend
+    _use_library(args.library or DEFAULT_LIBRARY)
 
     if args.delete:
         delete_by_doc_id(args.delete)
     elif args.pdf:
         add_pdf_to_index(args.pdf)
+    elif args.watch:
+        watch(args.interval)
+    elif args.sync:
+        sync_index()
     elif args.rebuild:
         rebuild_all()
     else:
@@ -0,0 +1,115 @@
+# conversation.py
+"""
+多轮对话的本地辅助（只用标准库，不调用 LLM）：
+
+- condense_query : 追问（"and what's the deadline for that?"）补上前几轮用户问题里的关键词，
+                   得到可以独立检索的查询
+- warm_ids       : 上一轮回答用过的片段 id，作为本轮的候选集
+- trim_history   : 按 token 预算（粗略按 4 字符 ≈ 1 token）从最新往前截取历史，
+                   去掉引用链接等不需要发给模型的内容
+
+history 的格式与 UI 里的 st.session_state.messages 一致：
+[{"role": "user" | "assistant", "content": str, "context_ids": [...]}, ...]
+"""
+import os
+import re
+from typing import Dict, List, Optional
+
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "800"))
+_CHARS_PER_TOKEN = 4
+_MAX_CONTEXT_TERMS = 6
+_USER_TURNS_FOR_CONTEXT = 2
+
+_WORD = re.compile(r"[A-Za-z][A-Za-z'-]{2,}")
+# 以连接词开头的一定是追问："and the deadline?" / "what about MSc?"
+_LEADING = re.compile(r"^\s*(and|also|what about|how about|then|or)\b", re.IGNORECASE)
+# 指代词只有在问题本身几乎没有内容词时才算追问（"when is it due?"），
+# "this" / "there" 之类太常见，不算
+_ANAPHOR = re.compile(r"\b(it|its|that|those|these|they|them|their|the same|which one)\b", re.IGNORECASE)
+_MAX_FOLLOWUP_TERMS = 2
+# [[1]](https://...) -> [1]，历史里不需要重复发送 URL
+_LINKED_CITATION = re.compile(r"\[\[(\d+)\]\]\([^)]*\)")
+
+_STOPWORDS = frozenset("""
+a about above after again all also am an and any are aren as at be because been before being
+below between both but by can could did do does doing down during each few for from further
+get got had has have having he her here hers him his how i if in into is it its itself just
+know let like may me might more most much must my need no nor not now of off on once only or
+other our ours out over own please same she should so some such tell than that the their them
+then there these they this those through to too under until up very want was we were what
+when where which while who whom why will with would you your yours thanks thank hello hi
+""".split())
+
+
+def _terms(text: str) -> List[str]:
+    """去掉停用词后的内容词（小写，保持出现顺序，去重）"""
+    seen, out = set(), []
+    for w in _WORD.findall(text or ""):
+        w = w.lower().strip("'-")
+        if len(w) < 3 or w in _STOPWORDS or w in seen:
+            continue
+        seen.add(w)
+        out.append(w)
+    return out
+
+
+def is_followup(query: str) -> bool:
+    query = query or ""
+    if _LEADING.search(query):
+        return True
+    return bool(_ANAPHOR.search(query)) and len(_terms(query)) <= _MAX_FOLLOWUP_TERMS
+
+
+def condense_query(query: str, history: Optional[List[Dict]]) -> str:
+    """
+    追问时把最近几轮用户问题里的关键词补到查询后面；
+    不像追问（或没有历史）时原样返回。
+    """
+    if not history or not is_followup(query):
+        return query
+    have = set(_terms(query))
+    extra: List[str] = []
+    user_turns = [m for m in reversed(history) if m.get("role") == "user"][:_USER_TURNS_FOR_CONTEXT]
+    for m in user_turns:
+        for t in _terms(m.get("content", "")):
+            if t not in have and t not in extra:
+                extra.append(t)
+            if len(extra) >= _MAX_CONTEXT_TERMS:
+                break
+        if len(extra) >= _MAX_CONTEXT_TERMS:
+            break
+    return f"{query} {' '.join(extra)}" if extra else query
+
+
+def warm_ids(history: Optional[List[Dict]]) -> List[str]:
+    """上一条助手回复用过的片段 id"""
+    for m in reversed(history or []):
+        if m.get("role") == "assistant":
+            return list(m.get("context_ids") or [])
+    return []
+
+
+def trim_history(history: Optional[List[Dict]], max_tokens: int = HISTORY_TOKEN_BUDGET) -> List[Dict]:
+    """从最新一条往前取，直到用完 token 预算；返回按时间顺序的 [{"role", "content"}]"""
+    budget = max_tokens * _CHARS_PER_TOKEN
+    kept: List[Dict] = []
+    for m in reversed(history or []):
+        role = m.get("role")
+        if role not in ("user", "assistant"):
+            continue
+        content = _LINKED_CITATION.sub(r"[\1]", (m.get("content") or "").strip())
+        if not content:
+            continue
+        if len(content) > budget:
+            # 最新的一条单独就超预算时截断保留；更早的直接丢弃
+            if not kept and budget > 0:
+                kept.append({"role": role, "content": content[:budget].rstrip() + "…"})
+            break
+        kept.append({"role": role, "content": content})
+        budget -= len(content)
+    kept.reverse()
+    return kept
+
+
+def format_history(turns: List[Dict]) -> str:
+    return "\n".join(f"{'User' if t['role'] == 'user' else 'Assistant'}: {t['content']}" for t in turns)
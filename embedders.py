@@ -0,0 +1,249 @@
+# embedders.py
+"""
+MiniLM 的可选 CPU 后端，qa_engine 和 build_vector_all 都通过 make_embeddings() 选择：
+
+- torch      : 原来的 HuggingFaceEmbeddings（PyTorch fp32，默认）
+- onnx       : 导出的 ONNX 模型，onnxruntime 推理
+- onnx-int8  : 上面的 ONNX 模型做 onnxruntime 动态 int8 量化
+- torch-int8 : PyTorch 动态量化（nn.Linear -> int8），不需要 onnxruntime
+
+三种新后端都按长度排序后分批、每批只 pad 到本批最长（dynamic padding），
+mean pooling + L2 归一化，和 sentence-transformers 的 all-MiniLM-L6-v2 输出一致，
+所以已有索引可以直接复用；用 `python embedders.py --parity` 检查余弦一致性。
+"""
+import abc
+import argparse
+import glob
+import json
+import os
+from typing import List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+EMBED_MODEL = "all-MiniLM-L6-v2"
+HF_REPO = f"sentence-transformers/{EMBED_MODEL}"
+EMBED_BACKEND = os.getenv("EMBED_BACKEND", "torch")
+EMBED_THREADS = int(os.getenv("EMBED_THREADS", "0") or 0)  # 0 = 由运行时决定
+BACKENDS = ("torch", "onnx", "onnx-int8", "torch-int8")
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+ONNX_DIR = os.getenv("ONNX_DIR", os.path.join(ROOT, "onnx_models", EMBED_MODEL))
+
+MAX_SEQ_LEN = 256  # 与 sentence-transformers 的 max_seq_length 保持一致
+
+
+def _mean_pool_normalize(hidden: np.ndarray, attention_mask: np.ndarray) -> np.ndarray:
+    mask = attention_mask[..., None].astype(np.float32)
+    summed = (hidden * mask).sum(axis=1)
+    counts = np.clip(mask.sum(axis=1), 1e-9, None)
+    emb = summed / counts
+    norms = np.clip(np.linalg.norm(emb, axis=1, keepdims=True), 1e-12, None)
+    return emb / norms
+
+
+class _MiniLMEmbeddings(Embeddings):
+    """公共部分：分词、按长度分桶的动态 padding、pooling；子类只实现 _forward"""
+
+    def __init__(self, batch_size: int = 32, num_threads: int = EMBED_THREADS):
+        from transformers import AutoTokenizer
+        self.batch_size = batch_size
+        self.num_threads = num_threads or os.cpu_count() or 1
+        self.tokenizer = AutoTokenizer.from_pretrained(HF_REPO)
+
+    @abc.abstractmethod
+    def _forward(self, enc) -> np.ndarray:
+        """返回 last_hidden_state，形状 (batch, seq, dim)"""
+
+    def _embed(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        texts = [t.replace("\n", " ") for t in texts]
+        # 按长度排序，避免短句被 pad 到整批里最长的那一条
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        out = np.empty((len(texts), 0), dtype=np.float32)
+        for start in range(0, len(order), self.batch_size):
+            idx = order[start:start + self.batch_size]
+            enc = self.tokenizer(
+                [texts[i] for i in idx],
+                padding="longest",
+                truncation=True,
+                max_length=MAX_SEQ_LEN,
+                return_tensors="np",
+            )
+            vecs = _mean_pool_normalize(self._forward(enc), enc["attention_mask"])
+            if out.shape[1] == 0:
+                out = np.empty((len(texts), vecs.shape[1]), dtype=np.float32)
+            out[idx] = vecs
+        return out.tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self._embed(list(texts))
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed([text])[0]
+
+
+def export_onnx(out_dir: str = ONNX_DIR, quantize: bool = True) -> str:
+    """导出 fp32 ONNX（以及可选的 int8 动态量化版本），返回目录"""
+    import torch
+    from transformers import AutoModel, AutoTokenizer
+
+    os.makedirs(out_dir, exist_ok=True)
+    # 多个进程（API 的多个 worker、UI 和构建子进程）可能同时首次导出：
+    # 先写到本进程的临时文件再 os.replace，别的进程不会读到写了一半的模型
+    suffix = f".{os.getpid()}.tmp"
+    fp32_path = os.path.join(out_dir, "model.onnx")
+    if not os.path.exists(fp32_path):
+        model = AutoModel.from_pretrained(HF_REPO).eval()
+        tok = AutoTokenizer.from_pretrained(HF_REPO)
+        sample = tok(["export sample"], return_tensors="pt")
+        dyn = {0: "batch", 1: "seq"}
+        with torch.no_grad():
+            torch.onnx.export(
+                model,
+                (sample["input_ids"], sample["attention_mask"], sample["token_type_ids"]),
+                fp32_path + suffix,
+                input_names=["input_ids", "attention_mask", "token_type_ids"],
+                output_names=["last_hidden_state"],
+                dynamic_axes={
+                    "input_ids": dyn,
+                    "attention_mask": dyn,
+                    "token_type_ids": dyn,
+                    "last_hidden_state": dyn,
+                },
+                opset_version=14,
+            )
+        os.replace(fp32_path + suffix, fp32_path)
+
+    int8_path = os.path.join(out_dir, "model.int8.onnx")
+    if quantize and not os.path.exists(int8_path):
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        quantize_dynamic(fp32_path, int8_path + suffix, weight_type=QuantType.QInt8)
+        os.replace(int8_path + suffix, int8_path)
+    return out_dir
+
+
+class OnnxMiniLMEmbeddings(_MiniLMEmbeddings):
+    """onnxruntime CPU 推理；quantize=True 时使用 int8 动态量化模型"""
+
+    def __init__(self, quantize: bool = False, model_dir: str = ONNX_DIR, **kw):
+        super().__init__(**kw)
+        import onnxruntime as ort
+
+        name = "model.int8.onnx" if quantize else "model.onnx"
+        path = os.path.join(model_dir, name)
+        if not os.path.exists(path):
+            export_onnx(model_dir, quantize=quantize)
+
+        opts = ort.SessionOptions()
+        opts.intra_op_num_threads = self.num_threads
+        opts.inter_op_num_threads = 1
+        opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(path, opts, providers=["CPUExecutionProvider"])
+        self._inputs = {i.name for i in self.session.get_inputs()}
+
+    def _forward(self, enc) -> np.ndarray:
+        feeds = {k: enc[k].astype(np.int64) for k in self._inputs if k in enc}
+        if "token_type_ids" in self._inputs and "token_type_ids" not in feeds:
+            feeds["token_type_ids"] = np.zeros_like(enc["input_ids"], dtype=np.int64)
+        return self.session.run(None, feeds)[0]
+
+
+class TorchInt8MiniLMEmbeddings(_MiniLMEmbeddings):
+    """PyTorch 动态量化（Linear 层权重 int8），不依赖 onnxruntime"""
+
+    def __init__(self, **kw):
+        super().__init__(**kw)
+        import torch
+        from transformers import AutoModel
+
+        torch.set_num_threads(self.num_threads)
+        model = AutoModel.from_pretrained(HF_REPO).eval()
+        self.model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        self._torch = torch
+
+    def _forward(self, enc) -> np.ndarray:
+        torch = self._torch
+        with torch.inference_mode():
+            out = self.model(**{k: torch.from_numpy(v) for k, v in enc.items()})
+        return out.last_hidden_state.numpy()
+
+
+def make_embeddings(backend: Optional[str] = None, **kw) -> Embeddings:
+    """按名字创建 embedding 后端（默认读环境变量 EMBED_BACKEND）"""
+    backend = (backend or EMBED_BACKEND).strip().lower()
+    if backend == "torch":
+        from langchain_community.embeddings import HuggingFaceEmbeddings
+        return HuggingFaceEmbeddings(model_name=EMBED_MODEL)
+    if backend == "onnx":
+        return OnnxMiniLMEmbeddings(quantize=False, **kw)
+    if backend == "onnx-int8":
+        return OnnxMiniLMEmbeddings(quantize=True, **kw)
+    if backend == "torch-int8":
+        return TorchInt8MiniLMEmbeddings(**kw)
+    raise ValueError(f"unknown embedding backend: {backend!r} (choose from {', '.join(BACKENDS)})")
+
+
+# ----------------- 一致性检查 -----------------
+def _sample_texts(n: int) -> List[str]:
+    """从 modules_ocr/*.jsonl 取样真实段落"""
+    texts = []
+    for path in sorted(glob.glob(os.path.join(ROOT, "modules_ocr", "*.jsonl"))):
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    t = (json.loads(line).get("text") or "").strip()
+                except Exception:
+                    continue
+                if t:
+                    texts.append(t)
+                if len(texts) >= n:
+                    return texts
+    return texts
+
+
+def parity_check(backend: str, texts: Optional[List[str]] = None, n: int = 200,
+                 threshold: float = 0.99) -> dict:
+    """
+    对比 backend 与 fp32 PyTorch 参考向量的余弦相似度。
+    最小值 >= threshold 时认为与现有索引兼容。
+    """
+    texts = texts or _sample_texts(n)
+    if not texts:
+        raise ValueError("no sample texts for parity check")
+    ref = np.asarray(make_embeddings("torch").embed_documents(texts), dtype=np.float32)
+    cand = np.asarray(make_embeddings(backend).embed_documents(texts), dtype=np.float32)
+    ref /= np.clip(np.linalg.norm(ref, axis=1, keepdims=True), 1e-12, None)
+    cand /= np.clip(np.linalg.norm(cand, axis=1, keepdims=True), 1e-12, None)
+    cos = (ref * cand).sum(axis=1)
+    return {
+        "backend": backend,
+        "n": len(texts),
+        "min": float(cos.min()),
+        "mean": float(cos.mean()),
+        "p01": float(np.percentile(cos, 1)),
+        "threshold": threshold,
+        "ok": bool(cos.min() >= threshold),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--backend", default="onnx-int8", choices=BACKENDS)
+    parser.add_argument("--export", action="store_true", help="export ONNX (+int8) models and exit")
+    parser.add_argument("--parity", action="store_true", help="compare against fp32 PyTorch vectors")
+    parser.add_argument("-n", type=int, default=200, help="number of sample texts for --parity")
+    parser.add_argument("--threshold", type=float, default=0.99)
+    args = parser.parse_args()
+
+    if args.export:
+        print("[ok] exported to", export_onnx())
+    if args.parity or not args.export:
+        res = parity_check(args.backend, n=args.n, threshold=args.threshold)
+        print(
+            f"[{'ok' if res['ok'] else 'warn'}] {res['backend']}: n={res['n']} "
+            f"cos min={res['min']:.5f} p01={res['p01']:.5f} mean={res['mean']:.5f} "
+            f"(threshold {res['threshold']})"
+        )
+        raise SystemExit(0 if res["ok"] else 1)
@@ -0,0 +1,92 @@
+# import_profile.py
+"""
+导入耗时报告：在子进程里用 `python -X importtime` 导入目标模块，
+汇总每个模块的 self / cumulative 耗时，用来追踪冷启动回归。
+
+用法：
+    python import_profile.py                     # 默认检查 qa_engine / qa_bridge / worker
+    python import_profile.py qa_engine --top 30
+    python import_profile.py qa_bridge --budget-ms 200   # 超出预算时返回非 0
+"""
+import argparse
+import os
+import re
+import subprocess
+import sys
+from typing import Dict, List, Tuple
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_TARGETS = ["qa_engine", "qa_bridge", "worker"]
+
+# -X importtime 的输出格式：
+# import time: self [us] | cumulative | imported package
+_LINE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S.*)$")
+
+
+def _run_importtime(module: str) -> str:
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(
+        [ROOT, os.path.join(ROOT, "new_ui"), env.get("PYTHONPATH", "")]
+    )
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT, env=env, capture_output=True, text=True,
+    )
+    if proc.returncode != 0:
+        tail = proc.stderr.strip().splitlines()[-1:] or ["(no output)"]
+        raise RuntimeError(f"import {module} failed: {tail[0]}")
+    return proc.stderr
+
+
+def parse_importtime(stderr: str) -> List[Tuple[str, int, int, int]]:
+    """返回 [(模块名, self_us, cumulative_us, 嵌套深度)]"""
+    rows = []
+    for line in stderr.splitlines():
+        m = _LINE.match(line)
+        if not m:
+            continue
+        self_us, cum_us, indent, name = m.groups()
+        rows.append((name.strip(), int(self_us), int(cum_us), len(indent) // 2))
+    return rows
+
+
+def profile(module: str) -> Dict:
+    rows = parse_importtime(_run_importtime(module))
+    top = [r for r in rows if r[0] == module]
+    total_us = top[-1][2] if top else sum(r[1] for r in rows)
+    return {"module": module, "total_us": total_us, "rows": rows}
+
+
+def report(result: Dict, top_n: int = 15) -> str:
+    lines = [f"== {result['module']}: {result['total_us'] / 1000:.1f} ms cumulative =="]
+    lines.append(f"{'cumulative ms':>14} {'self ms':>9}  module")
+    by_cum = sorted(result["rows"], key=lambda r: r[2], reverse=True)[:top_n]
+    for name, self_us, cum_us, depth in by_cum:
+        lines.append(f"{cum_us / 1000:>14.1f} {self_us / 1000:>9.1f}  {'  ' * depth}{name}")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("modules", nargs="*", default=DEFAULT_TARGETS, help="modules to import")
+    parser.add_argument("--top", type=int, default=15, help="rows per report")
+    parser.add_argument("--budget-ms", type=float, default=None,
+                        help="exit non-zero if any module exceeds this cumulative import time")
+    args = parser.parse_args()
+
+    over_budget = []
+    for mod in args.modules:
+        try:
+            res = profile(mod)
+        except RuntimeError as e:
+            print(f"[error] {e}")
+            over_budget.append(mod)
+            continue
+        print(report(res, args.top))
+        print()
+        if args.budget_ms is not None and res["total_us"] / 1000 > args.budget_ms:
+            over_budget.append(mod)
+
+    if over_budget:
+        print("[warn] over budget / failed:", ", ".join(over_budget))
+        sys.exit(1)
@@ -0,0 +1,242 @@
+# index_registry.py
+"""
+多资料库（多院系手册）索引注册表。
+
+目录约定：
+- default          : 原来的 vector_dbs_all/ + links.json + pdfs/（可用 INDEX_DIR / PDF_DIR 覆盖）
+- 其他资料库 <name> : libraries/<name>/vector_db/ + libraries/<name>/links.json + libraries/<name>/pdfs/
+                     （根目录可用 LIBRARIES_DIR 覆盖）
+
+IndexRegistry 在第一次查询时才加载对应索引，并按 LRU 在总内存预算
+（LIBRARY_MEM_BUDGET_MB）内淘汰，一个进程可以服务多个资料库而不必全部常驻内存。
+磁盘上的索引被（其他进程）重建后，下次查询会自动重新加载。
+本模块只用标准库；真正的加载函数由 qa_engine 传进来。
+"""
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_LIBRARY = "default"
+LIBRARIES_DIR = os.getenv("LIBRARIES_DIR", os.path.join(ROOT, "libraries"))
+MEM_BUDGET_MB = float(os.getenv("LIBRARY_MEM_BUDGET_MB", "1024"))
+# 构建完成后最后写入的版本标记，见 mark_published
+VERSION_FILE = "index.version"
+# index.faiss / index.pkl 已换入一部分、版本标记还没写：这时的文件不能加载
+PUBLISHING = "publishing"
+_LOAD_RETRIES = 10
+_RETRY_WAIT = 0.2
+
+# docstore（pickle 里的 Python 对象）在内存里大约是磁盘大小的几倍
+_PKL_OVERHEAD = 3.0
+_NAME_OK = re.compile(r"^[A-Za-z0-9][A-Za-z0-9_.-]*$")
+
+
+def _abs(path: str) -> str:
+    return path if os.path.isabs(path) else os.path.join(ROOT, path)
+
+
+def library_paths(name: Optional[str] = None) -> Dict[str, str]:
+    """返回资料库的 index_dir / links_json / pdf_dir（绝对路径）"""
+    name = name or DEFAULT_LIBRARY
+    if name == DEFAULT_LIBRARY:
+        return {
+            "index_dir": _abs(os.getenv("INDEX_DIR", "vector_dbs_all")),
+            "links_json": os.path.join(ROOT, "links.json"),
+            "pdf_dir": _abs(os.getenv("PDF_DIR", "pdfs")),
+        }
+    if not _NAME_OK.match(name):
+        raise ValueError(f"invalid library name: {name!r}")
+    base = os.path.join(LIBRARIES_DIR, name)
+    return {
+        "index_dir": os.path.join(base, "vector_db"),
+        "links_json": os.path.join(base, "links.json"),
+        "pdf_dir": os.path.join(base, "pdfs"),
+    }
+
+
+def list_libraries() -> List[str]:
+    names = [DEFAULT_LIBRARY]
+    if os.path.isdir(LIBRARIES_DIR):
+        for d in sorted(os.listdir(LIBRARIES_DIR)):
+            if d != DEFAULT_LIBRARY and _NAME_OK.match(d) and os.path.isdir(os.path.join(LIBRARIES_DIR, d)):
+                names.append(d)
+    return names
+
+
+def _file_stamp(index_dir: str):
+    """index.faiss 和 index.pkl 的 [mtime, size]；任一文件缺失返回 None"""
+    try:
+        return [
+            [st.st_mtime_ns, st.st_size]
+            for st in (os.stat(os.path.join(index_dir, n)) for n in ("index.faiss", "index.pkl"))
+        ]
+    except OSError:
+        return None
+
+
+def mark_published(index_dir: str):
+    """
+    新的 index.faiss / index.pkl 都换入之后调用：写版本标记（先写临时文件再 os.replace），
+    标记里记下两个文件的 stamp，读者据此判断看到的是不是同一次构建的完整文件
+    """
+    marker = os.path.join(index_dir, VERSION_FILE)
+    with open(marker + ".tmp", "w", encoding="utf-8") as f:
+        json.dump({"id": uuid.uuid4().hex, "files": _file_stamp(index_dir)}, f)
+    os.replace(marker + ".tmp", marker)
+
+
+def index_version(index_dir: str):
+    """
+    索引版本：有标记时返回标记 id；文件与标记对不上（正在换入）时返回 PUBLISHING；
+    没有标记的旧索引退回到两个文件的 (mtime, size)。
+    """
+    stamp = _file_stamp(index_dir)
+    try:
+        with open(os.path.join(index_dir, VERSION_FILE), "r", encoding="utf-8") as f:
+            marker = json.load(f)
+    except (OSError, ValueError):
+        return None if stamp is None else repr(stamp)
+    return marker.get("id") if marker.get("files") == stamp else PUBLISHING
+
+
+def estimate_bytes(index_dir: str) -> int:
+    """按磁盘大小估算加载后的内存：index.faiss 基本原样进内存，docstore 有额外开销"""
+    size = 0
+    try:
+        size += os.path.getsize(os.path.join(index_dir, "index.faiss"))
+    except OSError:
+        pass
+    try:
+        size += int(os.path.getsize(os.path.join(index_dir, "index.pkl")) * _PKL_OVERHEAD)
+    except OSError:
+        pass
+    return size
+
+
+def document_counts(name: Optional[str] = None) -> Dict[str, int]:
+    """读取构建时写出的 doc_counts.json，不加载索引"""
+    path = os.path.join(library_paths(name)["index_dir"], "doc_counts.json")
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f) or {}
+    except Exception:
+        return {}
+
+
+class IndexRegistry:
+    """按需加载 + LRU 淘汰的资料库索引缓存，线程安全"""
+
+    def __init__(self, loader: Callable[[str], object], budget_mb: float = MEM_BUDGET_MB):
+        self._loader = loader
+        self.budget_bytes = int(budget_mb * 1024 * 1024)
+        self._entries: "OrderedDict[str, Dict]" = OrderedDict()
+        self._stats: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+        self._loading: Dict[str, threading.Lock] = {}
+
+    def _stat(self, name: str) -> Dict:
+        return self._stats.setdefault(name, {
+            "loads": 0, "evictions": 0, "queries": 0, "bytes": 0,
+            "last_used": None, "load_seconds": None,
+        })
+
+    def _touch(self, name: str):
+        """调用方持有 self._lock"""
+        self._entries.move_to_end(name)
+        st = self._stat(name)
+        st["queries"] += 1
+        st["last_used"] = time.time()
+
+    def get(self, name: Optional[str] = None):
+        """返回资料库的向量库；未加载则加载，必要时按 LRU 淘汰其他资料库"""
+        name = name or DEFAULT_LIBRARY
+        index_dir = library_paths(name)["index_dir"]
+        version = index_version(index_dir)
+        with self._lock:
+            entry = self._entries.get(name)
+            # 正在发布新索引时继续用已加载的旧索引，等发布完成再切换
+            if entry is not None and version in (entry["version"], PUBLISHING):
+                self._touch(name)
+                return entry["db"]
+            load_lock = self._loading.setdefault(name, threading.Lock())
+
+        # 同一资料库只加载一次；不同资料库可以并行加载
+        with load_lock:
+            with self._lock:
+                entry = self._entries.get(name)
+                if entry is not None and version in (entry["version"], PUBLISHING):
+                    self._touch(name)
+                    return entry["db"]
+            if not os.path.exists(os.path.join(index_dir, "index.faiss")):
+                raise FileNotFoundError(f"library {name!r} has no index at {index_dir}")
+            t0 = time.time()
+            db, version = self._load_consistent(name, index_dir)
+            nbytes = estimate_bytes(index_dir)
+            with self._lock:
+                self._entries[name] = {"db": db, "bytes": nbytes, "version": version}
+                self._touch(name)
+                st = self._stat(name)
+                st["loads"] += 1
+                st["bytes"] = nbytes
+                st["load_seconds"] = round(time.time() - t0, 3)
+                self._evict(keep=name)
+            return db
+
+    def _load_consistent(self, name: str, index_dir: str):
+        """加载前后版本一致才算成功；正在发布或加载途中索引被替换就稍等重试"""
+        for _ in range(_LOAD_RETRIES):
+            before = index_version(index_dir)
+            if before == PUBLISHING:
+                time.sleep(_RETRY_WAIT)
+                continue
+            try:
+                db = self._loader(index_dir)
+            except Exception:
+                if index_version(index_dir) == before:
+                    raise
+                continue
+            if index_version(index_dir) == before:
+                return db, before
+        raise RuntimeError(f"library {name!r} kept changing while loading, try again")
+
+    def _evict(self, keep: str):
+        """调用方持有 self._lock；刚加载的资料库即使单独超预算也保留"""
+        total = sum(e["bytes"] for e in self._entries.values())
+        for victim in list(self._entries):
+            if total <= self.budget_bytes:
+                break
+            if victim == keep:
+                continue
+            total -= self._entries.pop(victim)["bytes"]
+            self._stat(victim)["evictions"] += 1
+
+    def invalidate(self, name: Optional[str] = None):
+        """丢弃已加载的索引，下次查询时重新从磁盘加载"""
+        with self._lock:
+            self._entries.pop(name or DEFAULT_LIBRARY, None)
+
+    def loaded(self) -> List[str]:
+        with self._lock:
+            return list(self._entries)
+
+    def stats(self) -> Dict[str, Dict]:
+        with self._lock:
+            out = {}
+            for name in list_libraries():
+                st = dict(self._stat(name))
+                st["loaded"] = name in self._entries
+                counts = document_counts(name)
+                st["documents"] = len(counts)
+                st["chunks"] = sum(counts.values())
+                out[name] = st
+            out["_total"] = {
+                "loaded_bytes": sum(e["bytes"] for e in self._entries.values()),
+                "budget_bytes": self.budget_bytes,
+            }
+            return out
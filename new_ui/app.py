@@ -1,19 +1,21 @@
+import json
 import os
 import time
 import uuid
 from pathlib import Path
-from typing import List, Dict
+from typing import List, Dict, Optional
 
 import streamlit as st
 
-from qa_bridge import init_engine, ask, reload_engine
+from qa_bridge import (
+    init_engine, start_engine_async, engine_status, ask, reload_engine, list_libraries, library_stats,
+)
 from worker import save_pdf, build_index_async, delete_pdf
+from index_registry import DEFAULT_LIBRARY, library_paths
 
 #  基础配置 
 st.set_page_config(page_title="Dissertation QA", layout="wide")
 ADMIN_PASS = os.getenv("ADMIN_PASS", "123456")
-INDEX_DIR = os.getenv("INDEX_DIR", "vector_dbs_all")
-PDF_DIR = os.getenv("PDF_DIR", "pdfs")
 
 # 样式：采用第一版紧凑样式 + 标题样式 
 st.markdown("""
@@ -31,14 +33,16 @@ if "admin_mode" not in st.session_state:
     st.session_state.admin_mode = False
 if "session_id" not in st.session_state:
     st.session_state.session_id = uuid.uuid4().hex[:8]
+if "library" not in st.session_state:
+    st.session_state.library = DEFAULT_LIBRARY
 
 #  文件与索引辅助 
 def _is_url(u: str) -> bool:
     return bool(u) and (u.startswith("http://") or u.startswith("https://") or u.startswith("/"))
 
 @st.cache_data(ttl=5)
-def list_pdfs() -> List[Dict]:
-    p = Path(PDF_DIR)
+def list_pdfs(pdf_dir: str) -> List[Dict]:
+    p = Path(pdf_dir)
     p.mkdir(parents=True, exist_ok=True)
     items = []
     for f in sorted(p.glob("*.pdf")):
@@ -51,24 +55,56 @@ def list_pdfs() -> List[Dict]:
     return items
 
 @st.cache_data(ttl=5)
-def indexed_doc_ids(index_dir: str) -> Dict[str, int]:
+def indexed_doc_ids(index_dir: str) -> Optional[Dict[str, int]]:
+    """读构建时写出的 doc_counts.json；缺失或比 index.pkl 旧时返回 None（管理页不加载索引和模型）"""
+    counts_path = os.path.join(index_dir, "doc_counts.json")
+    pkl_path = os.path.join(index_dir, "index.pkl")
+    if not os.path.exists(pkl_path):
+        return {}
     try:
-        from langchain_community.embeddings import HuggingFaceEmbeddings
-        from langchain_community.vectorstores import FAISS
-        emb = HuggingFaceEmbeddings(model_name="all-MiniLM-L6-v2")
-        db = FAISS.load_local(index_dir, emb, allow_dangerous_deserialization=True)
+        if os.path.getmtime(counts_path) < os.path.getmtime(pkl_path):
+            return None
+        with open(counts_path, "r", encoding="utf-8") as f:
+            return json.load(f) or {}
     except Exception:
-        return {}
-    counts = {}
-    for _, v in db.docstore._dict.items():
-        did = v.metadata.get("doc_id")
-        if not did or did == "__init__":
-            continue
-        counts[did] = counts.get(did, 0) + 1
-    return counts
+        return None
 
 #  侧边栏 
 with st.sidebar:
+    libraries = list_libraries()
+    if st.session_state.library not in libraries:
+        st.session_state.library = DEFAULT_LIBRARY
+    if len(libraries) > 1:
+        st.selectbox("Library", libraries, key="library")
+
+LIBRARY = st.session_state.library
+_paths = library_paths(LIBRARY)
+INDEX_DIR = _paths["index_dir"]
+PDF_DIR = _paths["pdf_dir"]
+
+#  后台加载引擎（不阻塞首屏渲染）
+start_engine_async(library=LIBRARY)
+
+_engine_state = engine_status()[0]
+
+
+# 后台线程加载完不会触发 Streamlit 重跑：加载期间每秒刷新一次指示器，状态变化后整页重跑并停止轮询
+@st.fragment(run_every=1.0 if _engine_state == "loading" else None)
+def engine_indicator():
+    state, err = engine_status()
+    if state == "ready":
+        st.caption("🟢 Engine ready")
+    elif state == "error":
+        st.caption(f"🔴 Engine failed to load: {err}")
+    else:
+        st.caption("🟡 Engine loading in background…")
+    if state != _engine_state:
+        st.rerun()
+
+
+with st.sidebar:
+    engine_indicator()
+
     st.markdown("### Library Admin")
     st.caption("Need to manage the library? Enter the admin password.")
 
@@ -100,14 +136,14 @@ with right:
 
 #  管理区（合并逻辑 + 第一版布局）
 if st.session_state.admin_mode:
-    st.subheader("🛠️ Library Maintenance")
+    st.subheader(f"🛠️ Library Maintenance ({LIBRARY})")
 
     st.info(
         "Quick guide: 1) Upload PDFs → 2) Click **Save and Update Library** → "
         "3) Click **Refresh Library** → 4) Start asking questions."
     )
 
-    top1, top2, top3, top4, top5 = st.columns([2, 1.1, 1.1, 1.1, 0.7])
+    top1, top2, top3, top4, top5, top6 = st.columns([2, 1.1, 1.1, 1.1, 1.1, 0.7])
     with top1:
         up = st.file_uploader("Upload PDF (Drag & Drop or Select)", type=["pdf"])
         source_url = st.text_input("Source URL (required)", placeholder="https://...")
@@ -118,29 +154,37 @@ if st.session_state.admin_mode:
             if not url:
                 st.error("Please enter a Source URL before saving.")
             else:
-                path = save_pdf(up, up.name, source_url=url)
-                build_index_async(target_pdf_path=path)
+                path = save_pdf(up, up.name, source_url=url, library=LIBRARY)
+                build_index_async(target_pdf_path=path, library=LIBRARY)
                 st.success(f"Saved: {os.path.basename(path)}. Incremental build started in background.")
                 list_pdfs.clear(); indexed_doc_ids.clear()
 
     with top3:
+        if st.button("Sync Changes (added / removed / edited files and links)", use_container_width=True):
+            build_index_async(sync=True, library=LIBRARY)
+            st.info("Sync started in the background")
+            list_pdfs.clear(); indexed_doc_ids.clear()
+
+    with top4:
         if st.button("Rebuild Entire Library (Slower)", use_container_width=True):
-            build_index_async()
+            build_index_async(library=LIBRARY)
             st.info("Full rebuild started in the background")
 
-    with top4:
+    with top5:
         if st.button("Refresh Library", use_container_width=True):
-            msg = reload_engine(INDEX_DIR)
+            msg = reload_engine(LIBRARY)
             st.success(f"Library status: {msg}")
             indexed_doc_ids.clear()
 
-    with top5:
+    with top6:
         if st.button("Refresh", use_container_width=True):
             list_pdfs.clear(); indexed_doc_ids.clear()
 
     st.markdown("### 📄 Document List")
-    files = list_pdfs()
+    files = list_pdfs(PDF_DIR)
     indexed = indexed_doc_ids(INDEX_DIR)
+    if indexed is None:
+        st.warning("Chunk counts unavailable, rebuild or sync the library once.")
 
     if not files:
         st.info("The PDFs folder is empty. Please upload some PDFs first.")
@@ -153,22 +197,24 @@ if st.session_state.admin_mode:
             size = f["size_mb"]
             mtime = f["mtime"]
             path = f["path"]
-            nvec = indexed.get(name, 0)
+            nvec = indexed.get(name, 0) if indexed is not None else None
 
             c1, c2, c3, c4, c5, c6 = st.columns([4.5, 1, 1.6, 1.7, 1.1, 1.4])
             c1.write(name)
             c2.write(size)
             c3.write(mtime)
             # c4.success(f"Indexed {nvec}") if nvec > 0 else c4.warning("Not yet searchable")
-            if nvec > 0:
+            if nvec is None:
+                c4.info("Unknown")
+            elif nvec > 0:
                 c4.success(f"Indexed {nvec}")
             else:
                 c4.warning("Not yet searchable")
 
 
             if c5.button("Delete", key=f"del_{name}", use_container_width=True):
-                delete_pdf(name)
-                build_index_async(delete_doc_id=name)
+                delete_pdf(name, library=LIBRARY)
+                build_index_async(delete_doc_id=name, library=LIBRARY)
                 st.warning(f"Submitted deletion: {name}. Click \"Refresh Library\" above to apply.")
                 list_pdfs.clear(); indexed_doc_ids.clear()
 
@@ -185,14 +231,19 @@ if st.session_state.admin_mode:
         else:
             st.caption("Library not found (please rebuild it once).")
 
-    st.divider()
+        stats = library_stats()
+        with st.expander("Library memory / usage", expanded=False):
+            total = stats.pop("_total", None)
+            for lib, stat in stats.items():
+                state = "loaded" if stat.get("loaded") else "not loaded"
+                mb = stat.get("bytes", 0) / 1024 / 1024
+                st.write(f"**{lib}** — {state}, {stat.get('documents', 0)} docs / {stat.get('chunks', 0)} chunks, "
+                         f"~{mb:.1f} MB, {stat.get('queries', 0)} queries, {stat.get('evictions', 0)} evictions")
+            if total:
+                st.caption(f"Loaded: {total['loaded_bytes'] / 1024 / 1024:.1f} MB "
+                           f"of {total['budget_bytes'] / 1024 / 1024:.0f} MB budget")
 
-#  初始化引擎 
-try:
-    init_engine(index_dir=INDEX_DIR)
-except Exception as e:
-    st.error(f"RuntimeError: Unable to start the engine. Please check qa_engine.py: {e}")
-    st.stop()
+    st.divider()
 
 #  引用函数 
 def _render_citation(c: Dict):
@@ -226,10 +277,16 @@ if user_input:
     with st.chat_message("assistant"):
         placeholder = st.empty()
         citations = []
+        context_ids = []
         try:
-            result = ask(user_input)
+            if engine_status()[0] != "ready":
+                with st.spinner("Loading the engine, please wait…"):
+                    init_engine(library=LIBRARY)
+            # 把本条之前的对话一并传入：追问会在本地补全成独立查询，并复用上一轮的片段
+            result = ask(user_input, library=LIBRARY, history=st.session_state.messages[:-1])
             answer_md = (result or {}).get("answer_md", "").strip()
             citations = (result or {}).get("citations", []) or []
+            context_ids = (result or {}).get("context_ids", []) or []
             if not answer_md:
                 answer_md = "(No answer generated — please check if the library is updated and reloaded)"
             placeholder.markdown(answer_md)
@@ -244,4 +301,5 @@ if user_input:
         "role": "assistant",
         "content": answer_md,
         "citations": citations,
+        "context_ids": context_ids,
     })
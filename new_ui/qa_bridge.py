@@ -1,5 +1,6 @@
 # new_ui/qa_bridge.py
 import os, sys
+import threading
 from typing import Optional
 
 ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -9,24 +10,96 @@ if ROOT not in sys.path:
 _qe = None
 _loaded = False
 
-def init_engine(index_dir: Optional[str] = None):
-    global _qe, _loaded
+# 后台加载状态：idle / loading / ready / error
+_state = "idle"
+_error: Optional[str] = None
+_thread: Optional[threading.Thread] = None
+_ready = threading.Event()
+_state_lock = threading.Lock()
+
+
+def _import_engine():
+    """qa_engine 本身导入很轻，重依赖在 load_engine() 里才加载"""
+    global _qe
+    if _qe is None:
+        import qa_engine as qe
+        _qe = qe
+    return _qe
+
+
+def _load(library: Optional[str]):
+    global _loaded, _state, _error
+    try:
+        qe = _import_engine()
+        qe.load_engine(library)
+        _loaded = True
+        _state = "ready"
+    except Exception as e:
+        _error = str(e)
+        _state = "error"
+    finally:
+        _ready.set()
+
+
+def start_engine_async(library: Optional[str] = None) -> threading.Thread:
+    """在后台线程加载引擎；重复调用只会启动一次（出错后可再次调用重试）。"""
+    global _thread, _state, _error
+    with _state_lock:
+        if _thread is not None and _state in ("loading", "ready"):
+            return _thread
+        _state, _error = "loading", None
+        _ready.clear()
+        _thread = threading.Thread(target=_load, args=(library,), daemon=True)
+        _thread.start()
+        return _thread
+
+
+def engine_status() -> tuple[str, Optional[str]]:
+    """返回 (状态, 错误信息)，供 UI 显示就绪指示"""
+    return _state, _error
+
+
+def init_engine(library: Optional[str] = None, timeout: Optional[float] = None):
+    """同步等待引擎就绪（未启动则先启动后台加载）"""
     if _loaded:
         return
-    import qa_engine as qe
-    _qe = qe
-    _loaded = True
+    start_engine_async(library)
+    if not _ready.wait(timeout):
+        raise TimeoutError("engine is still loading")
+    if _state == "error":
+        raise RuntimeError(_error)
 
-def reload_engine(index_dir: Optional[str] = None) -> str:
-    """调用 qa_engine.reload_index 热加载"""
+
+def reload_engine(library: Optional[str] = None) -> str:
+    """调用 qa_engine.reload_index 热加载指定资料库"""
     if not _loaded:
-        init_engine(index_dir)
+        init_engine(library)
     if hasattr(_qe, "reload_index"):
-        _qe.reload_index(index_dir or "vector_dbs_all")
+        _qe.reload_index(library)
         return "reloaded"
     return "noop"
 
-def ask(query: str):
+
+def list_libraries() -> list[str]:
+    """只扫描目录，不加载引擎"""
+    from index_registry import list_libraries as _list
+    return _list()
+
+
+def library_stats() -> dict:
+    """各资料库的加载 / 查询 / 内存统计；引擎未导入时只返回文档数"""
+    if _qe is not None:
+        return _qe.registry.stats()
+    from index_registry import document_counts, list_libraries as _list
+    out = {}
+    for name in _list():
+        counts = document_counts(name)
+        out[name] = {"loaded": False, "documents": len(counts), "chunks": sum(counts.values())}
+    return out
+
+
+def ask(query: str, library: Optional[str] = None, history: Optional[list] = None):
+    """history 为此前的 messages（不含本条问题）；为空时等同单轮问答"""
     if not _loaded:
-        init_engine()
-    return _qe.ask_question(query)
+        init_engine(library)
+    return _qe.ask_question(query, library=library, history=history)
@@ -3,97 +3,120 @@ import os
 import json
 import shutil
 import subprocess
+import sys
 import threading
 from typing import Optional
 
 # 路径常量
 ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-PDF_DIR = os.path.join(ROOT, "pdfs")
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
 BUILD = os.path.join(ROOT, "build_vector_all.py")
 
+from index_registry import DEFAULT_LIBRARY, library_paths
+
+# 与 qa_engine / build_vector_all 使用同一套路径（index_registry.library_paths）
+PDF_DIR = library_paths(DEFAULT_LIBRARY)["pdf_dir"]
+
 # 静态目录（用于前端直接点击预览 /static/pdfs/<file>）
 STATIC_PDF_DIR = os.path.join(ROOT, ".streamlit", "static", "pdfs")
 os.makedirs(STATIC_PDF_DIR, exist_ok=True)
 
 # 手动链接配置
-LINKS_JSON = os.path.join(ROOT, "links.json")
+LINKS_JSON = library_paths(DEFAULT_LIBRARY)["links_json"]
+
+
+def _paths(library: Optional[str]):
+    """返回 (pdf_dir, links_json, static_dir)，路径见 index_registry.library_paths"""
+    library = library or DEFAULT_LIBRARY
+    p = library_paths(library)
+    static_dir = STATIC_PDF_DIR if library == DEFAULT_LIBRARY else os.path.join(STATIC_PDF_DIR, library)
+    return p["pdf_dir"], p["links_json"], static_dir
 
 
-def _update_links_map(filename: str, source_url: Optional[str]):
+def _update_links_map(filename: str, source_url: Optional[str], library: Optional[str] = None):
     """把老师手填的来源 URL 写入 links.json（供索引优先使用）。"""
     if not source_url:
         return
+    _, links_json, _ = _paths(library)
     try:
         data = {}
-        if os.path.exists(LINKS_JSON):
-            with open(LINKS_JSON, "r", encoding="utf-8") as f:
+        if os.path.exists(links_json):
+            with open(links_json, "r", encoding="utf-8") as f:
                 data = json.load(f) or {}
         data[filename] = source_url
-        with open(LINKS_JSON, "w", encoding="utf-8") as f:
+        with open(links_json, "w", encoding="utf-8") as f:
             json.dump(data, f, ensure_ascii=False, indent=2)
     except Exception:
         # 不阻塞主流程
         pass
 
 
-def _remove_link_from_map(filename: str):
+def _remove_link_from_map(filename: str, library: Optional[str] = None):
     """从 links.json 删除对应文件名的手动来源链接。"""
+    _, links_json, _ = _paths(library)
     try:
-        if not os.path.exists(LINKS_JSON):
+        if not os.path.exists(links_json):
             return
-        with open(LINKS_JSON, "r", encoding="utf-8") as f:
+        with open(links_json, "r", encoding="utf-8") as f:
             data = json.load(f) or {}
         if filename in data:
             data.pop(filename, None)
-            with open(LINKS_JSON, "w", encoding="utf-8") as f:
+            with open(links_json, "w", encoding="utf-8") as f:
                 json.dump(data, f, ensure_ascii=False, indent=2)
     except Exception:
         # 不阻塞主流程
         pass
 
 
-def save_pdf(file, filename: Optional[str] = None, source_url: Optional[str] = None) -> str:
+def save_pdf(file, filename: Optional[str] = None, source_url: Optional[str] = None,
+             library: Optional[str] = None) -> str:
     """
     保存上传的 PDF 到 pdfs/，复制一份到 .streamlit/static/pdfs/，
     并将可选的来源 URL 记录到 links.json。
     """
-    os.makedirs(PDF_DIR, exist_ok=True)
+    pdf_dir, _, static_dir = _paths(library)
+    os.makedirs(pdf_dir, exist_ok=True)
+    os.makedirs(static_dir, exist_ok=True)
     name = filename or file.name
-    path = os.path.join(PDF_DIR, name)
+    path = os.path.join(pdf_dir, name)
     with open(path, "wb") as f:
         f.write(file.read())
 
     # 复制静态副本，供 /static/pdfs/<name> 直接点击
     try:
-        shutil.copy2(path, os.path.join(STATIC_PDF_DIR, name))
+        shutil.copy2(path, os.path.join(static_dir, name))
     except Exception:
         pass
 
     # 记录手动来源链接
-    _update_links_map(name, source_url)
+    _update_links_map(name, source_url, library)
     return path
 
 
-def delete_pdf(filename: str) -> None:
+def delete_pdf(filename: str, library: Optional[str] = None) -> None:
     """从文件系统删除 PDF 本体和静态副本，并移除 links.json 中的手动链接。"""
-    for base in (PDF_DIR, STATIC_PDF_DIR):
+    pdf_dir, _, static_dir = _paths(library)
+    for base in (pdf_dir, static_dir):
         try:
             os.remove(os.path.join(base, filename))
         except FileNotFoundError:
             pass
     # 同步清理手动链接
-    _remove_link_from_map(filename)
+    _remove_link_from_map(filename, library)
 
 
 def _run(cmd: list[str]):
-    subprocess.run(cmd, check=True)
+    subprocess.run(cmd, check=True, cwd=ROOT)
 
 
-def build_index_async(target_pdf_path: Optional[str] = None, delete_doc_id: Optional[str] = None):
+def build_index_async(target_pdf_path: Optional[str] = None, delete_doc_id: Optional[str] = None,
+                      sync: bool = False, library: Optional[str] = None):
     """
     后台线程调用 build_vector_all.py：
     - --pdf <path>       增量添加
     - --delete <doc_id>  删除
+    - --sync             只应用 pdfs/ 与 links.json 的变化
     - --rebuild          全量重建
     """
     if not os.path.exists(BUILD):
@@ -103,8 +126,12 @@ def build_index_async(target_pdf_path: Optional[str] = None, delete_doc_id: Opti
         cmd = ["python", BUILD, "--delete", delete_doc_id]
     elif target_pdf_path:
         cmd = ["python", BUILD, "--pdf", target_pdf_path]
+    elif sync:
+        cmd = ["python", BUILD, "--sync"]
     else:
         cmd = ["python", BUILD, "--rebuild"]
+    if library and library != DEFAULT_LIBRARY:
+        cmd += ["--library", library]
 
     t = threading.Thread(target=_run, args=(cmd,), daemon=True)
     t.start()
@@ -0,0 +1,126 @@
+# postprocess.py
+"""
+答案后处理：关键词加粗、引用编号规范化 + 链接化、来源→片段映射。
+
+和 qa_engine 里原来的写法相比：
+- 关键词加粗：每个查询只编译一次 (tok1|tok2|...) 交替正则，一次 sub 完成，
+  不再为每个 token 各跑一遍 re.sub
+- 引用：[1, 2] / [1 2] / [1;2;3] 的拆分和 [n] -> [[n]](url) 在同一次线性扫描里完成，
+  不再循环 re.sub 到不动点
+- 来源编号：遍历一次 docs 同时得到编号表和每个来源对应的第一个片段
+- CitationStream 可以处理流式输出的半截文本（例如 "... [1, " 还没收到 "2]"）
+"""
+import re
+from functools import lru_cache
+from typing import Dict, List, Optional, Pattern, Tuple
+
+_QUERY_WORD = re.compile(r"[A-Za-z]{3,}")
+# 单个或成组的引用：[3] / [1, 2] / [1 2] / [1;2;4]
+# 分隔符只有一种匹配方式（"," / ";" 两侧可有空白，或纯空白），未闭合的组不会指数回溯
+_CITE_GROUP = re.compile(r"\[(\d+(?:(?:\s*[,;]\s*|\s+)\d+)*)\]")
+_CITE_SEP = re.compile(r"\s*[,;]\s*|\s+")
+# 流式输出末尾可能还没写完的引用，例如 "[", "[1", "[1, 2"
+_CITE_PARTIAL_TAIL = re.compile(r"\[[\d,; ]*$")
+_MAX_PARTIAL = 64
+
+
+def to_list(val) -> List[str]:
+    """只保留非空且是 http/https 开头的链接"""
+    if not val or val == "N/A":
+        return []
+    if isinstance(val, list):
+        return [x for x in val if isinstance(x, str) and x.strip().lower().startswith(("http://", "https://"))]
+    if isinstance(val, str) and val.strip().lower().startswith(("http://", "https://")):
+        return [val.strip()]
+    return []
+
+
+# ----------------- 关键词加粗 -----------------
+@lru_cache(maxsize=256)
+def compile_highlighter(query: str) -> Optional[Pattern]:
+    """把查询里的词编译成一个交替正则；长词在前，保证优先匹配更长的词"""
+    tokens = sorted({t.lower() for t in _QUERY_WORD.findall(query or "")}, key=lambda t: (-len(t), t))
+    if not tokens:
+        return None
+    return re.compile(r"\b(" + "|".join(re.escape(t) for t in tokens) + r")\b", re.IGNORECASE)
+
+
+def bold_keywords(text: str, query: str) -> str:
+    pattern = compile_highlighter(query)
+    if pattern is None or not text:
+        return text
+    return pattern.sub(r"**\1**", text)
+
+
+# ----------------- 引用编号 -----------------
+def _citation_replacer(ordered_sources: List[str]):
+    max_n = len(ordered_sources)
+
+    def link(n: str) -> str:
+        i = int(n)
+        if 1 <= i <= max_n:
+            return f"[[{i}]]({ordered_sources[i - 1]})"
+        return f"[{n}]"
+
+    def repl(m) -> str:
+        body = m.group(1)
+        if body.isdigit():
+            return link(body)
+        return "".join(link(n) for n in _CITE_SEP.split(body))
+
+    return repl
+
+
+def format_citations(text: str, ordered_sources: List[str]) -> str:
+    """[1, 2] 拆成 [1][2]，有效编号链接为 [[n]](url)，无效编号原样保留；一次扫描完成"""
+    if not text:
+        return text
+    return _CITE_GROUP.sub(_citation_replacer(ordered_sources), text)
+
+
+class CitationStream:
+    """
+    流式版本的 format_citations：feed() 返回已经可以安全输出的部分，
+    末尾可能是半截引用的内容先留在缓冲区，flush() 输出剩余部分。
+    """
+
+    def __init__(self, ordered_sources: List[str]):
+        self._repl = _citation_replacer(ordered_sources)
+        self._pending = ""
+
+    def feed(self, chunk: str) -> str:
+        buf = self._pending + (chunk or "")
+        # 只看末尾一小段，保证每次 feed 的开销与 chunk 长度成正比
+        tail_start = max(0, len(buf) - _MAX_PARTIAL)
+        m = _CITE_PARTIAL_TAIL.search(buf, tail_start)
+        cut = m.start() if m else len(buf)
+        self._pending = buf[cut:]
+        return _CITE_GROUP.sub(self._repl, buf[:cut])
+
+    def flush(self) -> str:
+        out, self._pending = _CITE_GROUP.sub(self._repl, self._pending), ""
+        return out
+
+
+# ----------------- 来源 → 编号 / 片段 -----------------
+def build_source_index(docs) -> Tuple[List[str], Dict[str, int], List[List[str]], Dict[str, object]]:
+    """
+    遍历一次 docs，返回：
+    - ordered_sources : 按首次出现排序的来源 URL
+    - source_to_id    : URL -> 引用编号（从 1 开始）
+    - doc_sources     : 与 docs 对齐的每个片段的来源列表
+    - first_doc       : URL -> 第一个引用它的片段
+    """
+    ordered_sources: List[str] = []
+    source_to_id: Dict[str, int] = {}
+    doc_sources: List[List[str]] = []
+    first_doc: Dict[str, object] = {}
+    for d in docs:
+        srcs = to_list(d.metadata.get("source"))
+        doc_sources.append(srcs)
+        for s in srcs:
+            if s not in source_to_id:
+                source_to_id[s] = len(ordered_sources) + 1
+                ordered_sources.append(s)
+                first_doc[s] = d
+    return ordered_sources, source_to_id, doc_sources, first_doc
@@ -1,78 +1,148 @@
 # qa_engine.py
-import os, re
+import os
+import threading
+import weakref
+from typing import Dict, List, Optional
+
 from dotenv import load_dotenv
-from langchain_community.vectorstores import FAISS
-from langchain_community.embeddings import HuggingFaceEmbeddings
-import google.generativeai as genai
+
+from conversation import condense_query, format_history, trim_history, warm_ids
+from index_registry import IndexRegistry
+from postprocess import CitationStream, bold_keywords, build_source_index, format_citations
 
 load_dotenv()
 
-# Embedding / Vector store 
-embedding = HuggingFaceEmbeddings(model_name="all-MiniLM-L6-v2")
-db = FAISS.load_local("vector_dbs_all", embedding, allow_dangerous_deserialization=True)
-
-#  Gemini 
-genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
-model = genai.GenerativeModel("models/gemini-2.5-flash-lite")
-
-
-def _bold_keywords(text: str, query: str) -> str:
-   
-    tokens = sorted({t.lower() for t in re.findall(r"[A-Za-z]{3,}", query)}, key=len, reverse=True)
-    for t in tokens:
-        text = re.sub(rf"(?i)\b({re.escape(t)})\b", r"**\1**", text)
-    return text
-
-
-def _to_list(val):
-    """只保留非空且是 http/https 开头的链接"""
-    if not val or val == "N/A":
-        return []
-    if isinstance(val, list):
-        return [x for x in val if isinstance(x, str) and x.strip().lower().startswith(("http://", "https://"))]
-    if isinstance(val, str) and val.strip().lower().startswith(("http://", "https://")):
-        return [val.strip()]
-    return []
-
-def _normalize_citation_groups(text: str) -> str:
-    """把 [1, 2] / [1 2] / [1;2] 这些拆成 [1][2]；多次迭代直到没有可替换的"""
-    prev = None
-    while prev != text:
-        prev = text
-        text = re.sub(r"\[(\d+)\s*[,; ]\s*(\d+)\]", r"[\1][\2]", text)
-    return text
-
-def _linkify_citations(text: str, ordered_sources: list[str]) -> str:
-    """把 [n] 变成 [[n]](url)，只链接有效编号。"""
-    max_n = len(ordered_sources)
-    def repl(m):
-        n = int(m.group(1))
-        if 1 <= n <= max_n:
-            return f"[[{n}]]({ordered_sources[n-1]})"
-        return m.group(0)
-    return re.sub(r"\[(\d+)\]", repl, text)
+EMBED_BACKEND = os.getenv("EMBED_BACKEND", "torch")  # torch / onnx / onnx-int8 / torch-int8，见 embedders.py
+GEMINI_MODEL = "models/gemini-2.5-flash-lite"
+# 多轮对话：上一轮片段与新查询的 L2 距离（平方）都不超过该值时，直接复用，不再检索
+WARM_MAX_DISTANCE = float(os.getenv("WARM_MAX_DISTANCE", "0.5"))
 
-# 
-def ask_question(user_query, k=4):
-    # 1) 检索
-    docs = db.similarity_search(user_query, k=k)
-
-    # 2) 构建来源→编号
-    source_to_id, ordered_sources = {}, []
-    for d in docs:
-        for s in _to_list(d.metadata.get("source")):
-            if s not in source_to_id:
-                source_to_id[s] = len(source_to_id) + 1
-                ordered_sources.append(s)
+# 重依赖（LangChain / torch / FAISS / Gemini）全部延迟到第一次使用时再导入，
+# 这样 import qa_engine 本身几乎零开销，UI 可以先渲染再在后台加载。
+# 各资料库的 FAISS 索引由 registry 按需加载、按内存预算做 LRU 淘汰。
+embedding = None
+model = None
+registry = IndexRegistry(lambda index_dir: _load_faiss(index_dir, _get_embedding()))
+_load_lock = threading.Lock()
+
+
+def _make_embedding():
+    from embedders import make_embeddings
+    return make_embeddings(EMBED_BACKEND)
+
+
+def _get_embedding():
+    global embedding
+    if embedding is None:
+        with _load_lock:
+            if embedding is None:
+                embedding = _make_embedding()
+    return embedding
+
+
+def _load_faiss(index_dir: str, emb):
+    from langchain_community.vectorstores import FAISS
+    return FAISS.load_local(index_dir, emb, allow_dangerous_deserialization=True)
+
+
+def _get_model():
+    global model
+    if model is None:
+        with _load_lock:
+            if model is None:
+                import google.generativeai as genai
+                genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
+                model = genai.GenerativeModel(GEMINI_MODEL)
+    return model
+
+
+def load_engine(library: Optional[str] = None):
+    """加载 embedding / Gemini，并预热指定资料库（默认 default）；线程安全。"""
+    _get_embedding()
+    _get_model()
+    registry.get(library)
+
+
+def is_loaded() -> bool:
+    return embedding is not None and model is not None
+
+
+def get_db(library: Optional[str] = None):
+    """返回资料库的向量库（未加载则加载）"""
+    return registry.get(library)
+
+
+# docstore id -> 向量位置，按 db 对象缓存（索引大小变化时重建）
+_id_positions = weakref.WeakKeyDictionary()
+
+
+def _positions(db) -> Dict[str, int]:
+    cached = _id_positions.get(db)
+    if cached is None or cached[0] != len(db.index_to_docstore_id):
+        cached = (len(db.index_to_docstore_id), {v: k for k, v in db.index_to_docstore_id.items()})
+        _id_positions[db] = cached
+    return cached[1]
+
+
+def _retrieve(db, query: str, k: int, warm: Optional[List[str]] = None):
+    """
+    返回 [(docstore_id, doc, distance)]，按距离升序。
+    warm 是上一轮用过的片段 id：先用本轮查询向量给它们打分，
+    足够相关就直接复用，否则再做一次 FAISS 检索并与之合并。
+    """
+    import numpy as np
+
+    q = np.asarray(_get_embedding().embed_query(query), dtype="float32")
+    scored: Dict[str, float] = {}
+    if warm:
+        pos = _positions(db)
+        for did in warm:
+            p = pos.get(did)
+            if p is None:
+                continue
+            try:
+                v = db.index.reconstruct(int(p))
+            except Exception:
+                continue
+            scored[did] = float(((v - q) ** 2).sum())
+        hits = sorted(scored.items(), key=lambda x: x[1])[:k]
+        if len(hits) >= k and hits[-1][1] <= WARM_MAX_DISTANCE:
+            return [(did, db.docstore.search(did), d) for did, d in hits]
+
+    distances, positions = db.index.search(q[None, :], k)
+    for p, d in zip(positions[0], distances[0]):
+        if p == -1:
+            continue
+        scored[db.index_to_docstore_id[int(p)]] = float(d)
+    hits = sorted(scored.items(), key=lambda x: x[1])[:k]
+    return [(did, db.docstore.search(did), d) for did, d in hits]
+
+
+def _prepare(user_query, k=4, library: Optional[str] = None, history: Optional[List[Dict]] = None):
+    """检索并拼装 prompt；返回 (prompt, ordered_sources, first_doc, context_ids)"""
+    # 1) 检索（多轮时先在本地把追问补全成独立查询，并复用上一轮的片段）
+    search_query = condense_query(user_query, history)
+    hits = _retrieve(get_db(library), search_query, k, warm_ids(history))
+    docs = [d for _, d, _ in hits]
+    context_ids = [did for did, _, _ in hits]
+
+    # 2) 构建来源→编号（一次遍历）
+    ordered_sources, source_to_id, doc_sources, first_doc = build_source_index(docs)
 
     # 3) 供模型参考的片段（带允许的标签）
     parts = []
-    for d in docs:
-        ids = "".join(f"[{source_to_id[s]}]" for s in _to_list(d.metadata.get("source"))) or "[N/A]"
+    for d, srcs in zip(docs, doc_sources):
+        ids = "".join(f"[{source_to_id[s]}]" for s in srcs) or "[N/A]"
         meta = f"(module={d.metadata.get('module','N/A')}, page={d.metadata.get('page','N/A')})"
         parts.append(f"{ids} {meta}\n{d.page_content}")
     context = "\n\n".join(parts)
 
+    turns = trim_history(history)
+    history_block = (
+        "Conversation so far (use it only to understand what the question refers to; "
+        "cite only the reference content below):\n" + format_history(turns) + "\n\n"
+    ) if turns else ""
+
     # 4) 生成 —— 合并你的风格 + 稳定引用规则
     prompt = f"""
 You are a helpful assistant for chemistry postgraduate students.
@@ -94,7 +164,7 @@ Citation rules (strict):
 - Each tag must be standalone like [1]; if multiple apply, write them back-to-back with no commas/spaces: [1][2][4]
 - Do NOT output URLs or a sources list; only use the inline tags
 
-Reference Content (each snippet is prefixed with the allowed tag(s)):
+{history_block}Reference Content (each snippet is prefixed with the allowed tag(s)):
 {context}
 
 User's Question:
@@ -102,29 +172,21 @@ User's Question:
 
 Answer:
 """.strip()
+    return prompt, ordered_sources, first_doc, context_ids
 
-    resp = model.generate_content(prompt)
-    base = (resp.text or "").strip()
 
-    
-    base = _normalize_citation_groups(base)
-    answer_md = _linkify_citations(base, ordered_sources)
-
-    
+def _build_citations(user_query, ordered_sources, first_doc):
+    # bold_keywords 按查询缓存编译好的正则，各片段复用
     citations = []
     for idx, url in enumerate(ordered_sources, start=1):
-        chosen = None
-        for d in docs:
-            if url in _to_list(d.metadata.get("source")):
-                chosen = d
-                break
+        chosen = first_doc.get(url)
         module = chosen.metadata.get("module", "N/A") if chosen else "N/A"
         page = chosen.metadata.get("page", "N/A") if chosen else "N/A"
         raw = (chosen.page_content if chosen else "") or ""
         excerpt = raw.strip().replace("\n", " ")
         #if len(excerpt) > 260:
             #excerpt = excerpt[:260].rstrip() + "…"
-        excerpt = _bold_keywords(excerpt, user_query)
+        excerpt = bold_keywords(excerpt, user_query)
         if len(excerpt) > 420:                            
             excerpt = excerpt[:420].rstrip() + "…"
         citations.append({
@@ -135,12 +197,60 @@ Answer:
             "excerpt": excerpt if excerpt else "(no excerpt)",
         })
 
-    return {"answer_md": answer_md, "citations": citations}
+    return citations
+
 
-def reload_index(index_dir: str = "vector_dbs_all"):
+# 
+def ask_question(user_query, k=4, library: Optional[str] = None, history: Optional[List[Dict]] = None):
+    """
+    history 为此前的对话（格式同 UI 的 messages）；返回值里的 context_ids
+    随助手消息一起存回 history，下一轮会作为候选片段复用。
+    """
+    prompt, ordered_sources, first_doc, context_ids = _prepare(user_query, k, library, history)
+
+    resp = _get_model().generate_content(prompt)
+    base = (resp.text or "").strip()
+
+    answer_md = format_citations(base, ordered_sources)
+    citations = _build_citations(user_query, ordered_sources, first_doc)
+    return {"answer_md": answer_md, "citations": citations, "context_ids": context_ids}
+
+
+def ask_question_stream(user_query, k=4, library: Optional[str] = None, history: Optional[List[Dict]] = None):
+    """
+    流式版本：逐段产出 {"type": "delta", "text": ...}（引用已链接化），
+    最后产出 {"type": "citations", "citations": [...], "context_ids": [...]}。
+    """
+    prompt, ordered_sources, first_doc, context_ids = _prepare(user_query, k, library, history)
+
+    stream = CitationStream(ordered_sources)
+    for chunk in _get_model().generate_content(prompt, stream=True):
+        try:
+            piece = chunk.text or ""
+        except ValueError:  # 被安全过滤等没有文本的块
+            piece = ""
+        text = stream.feed(piece)
+        if text:
+            yield {"type": "delta", "text": text}
+    tail = stream.flush()
+    if tail:
+        yield {"type": "delta", "text": tail}
+    yield {
+        "type": "citations",
+        "citations": _build_citations(user_query, ordered_sources, first_doc),
+        "context_ids": context_ids,
+    }
+
+
+def search(user_query, k=4, library: Optional[str] = None):
+    """只检索不生成，返回片段、metadata 和 L2 距离"""
+    results = get_db(library).similarity_search_with_score(user_query, k=k)
+    return [
+        {"content": d.page_content, "metadata": dict(d.metadata), "score": float(score)}
+        for d, score in results
+    ]
+
+def reload_index(library: Optional[str] = None):
     """renew FAISS """
-    global embedding, db
-    from langchain_community.embeddings import HuggingFaceEmbeddings
-    from langchain_community.vectorstores import FAISS
-    embedding = HuggingFaceEmbeddings(model_name="all-MiniLM-L6-v2")
-    db = FAISS.load_local(index_dir, embedding, allow_dangerous_deserialization=True)
\ No newline at end of file
+    registry.invalidate(library)
+    registry.get(library)
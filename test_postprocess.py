@@ -0,0 +1,24 @@
+# test_postprocess.py
+"""引用正则的回归测试：病态输入（未闭合的长引用组）也必须线性时间完成"""
+import time
+
+from postprocess import CitationStream, format_citations
+
+SOURCES = ["https://a.example", "https://b.example", "https://c.example"]
+
+
+def test_citation_groups():
+    for text in ("[1, 2]", "[1 2]", "[1;2]", "[1 ,2]"):
+        assert format_citations(text, SOURCES) == "[[1]](https://a.example)[[2]](https://b.example)"
+    assert format_citations("[1;2;3]", SOURCES).count("](https://") == 3
+    assert format_citations("[7]", SOURCES) == "[7]"
+
+
+def test_unclosed_group_is_linear():
+    text = "See [1" + "  2" * 2000 + " and more text."
+    t0 = time.time()
+    assert format_citations(text, SOURCES) == text
+    stream = CitationStream(SOURCES)
+    out = "".join(stream.feed(text[i:i + 7]) for i in range(0, len(text), 7)) + stream.flush()
+    assert out == text
+    assert time.time() - t0 < 1.0